@@ -1,8 +1,14 @@
-from flask import Flask, render_template, request, redirect, url_for, jsonify
-import requests, psycopg, os
+from flask import Flask, Response, render_template, stream_with_context, request, redirect, url_for
+import requests, psycopg, orjson, os, atexit, threading, time
+from psycopg.conninfo import make_conninfo
+from psycopg_pool import ConnectionPool
+from apscheduler.executors.pool import ThreadPoolExecutor as SchedulerThreadPool
 from apscheduler.schedulers.background import BackgroundScheduler
 from apscheduler.triggers.interval import IntervalTrigger
+from concurrent.futures import Future, ThreadPoolExecutor
 from datetime import timezone, datetime
+from requests.adapters import HTTPAdapter
+from urllib.parse import urlsplit
 
 app = Flask(__name__)
 app.secret_key = os.environ.get("SECRET_KEY", "dev-secret-key")
@@ -14,70 +20,249 @@ DB_NAME = os.getenv("DB_NAME")
 DB_USER = os.getenv("DB_USER")
 DB_PASSWORD = os.getenv("DB_PASSWORD")
 
+# Web server threads; the DB pool is sized above this so requests don't queue on it
+WEB_THREADS = int(os.getenv("WEB_THREADS", 16))
+
+# Each open /stream holds a server thread; cap them so normal requests always have threads left
+MAX_STREAMS = int(os.getenv("MAX_STREAMS", max(1, WEB_THREADS // 4)))
+
+DB_CONNINFO = make_conninfo(
+    host=DB_HOST,
+    port=DB_PORT,
+    dbname=DB_NAME,
+    user=DB_USER,
+    password=DB_PASSWORD
+)
+
+
+# ✅ Reuse connections across requests instead of a new handshake per call
+POOL = ConnectionPool(
+    conninfo=DB_CONNINFO,
+    min_size=2,
+    max_size=WEB_THREADS + 4,
+    # prepare_threshold=0: server-side prepare every statement on first use
+    kwargs={"autocommit": True, "prepare_threshold": 0},
+    open=True
+)
+atexit.register(POOL.close)
+
 
 def get_db():
-    return psycopg.connect(
-        host=DB_HOST,
-        port=DB_PORT,
-        dbname=DB_NAME,
-        user=DB_USER,
-        password=DB_PASSWORD,
-        autocommit=True
-    )
+    """Borrow a pooled connection (use as `with get_db() as conn:`)"""
+    return POOL.connection()
 
 
 # ---------------- INIT DB ----------------
+# All DDL is sent as one multi-statement string: a single round-trip, and
+# Postgres runs it as one implicit transaction.
+INIT_SQL = """
+-- ✅ Serialize concurrent startups (several app processes): without this the
+-- DDL transactions deadlock on each other's catalog locks.
+-- Released automatically at the end of the implicit transaction.
+SELECT pg_advisory_xact_lock(727001);
+
+CREATE TABLE IF NOT EXISTS cities (
+    id SERIAL PRIMARY KEY,
+    name TEXT UNIQUE,
+    lat REAL,
+    lon REAL
+);
+
+CREATE TABLE IF NOT EXISTS weather_logs (
+    id SERIAL PRIMARY KEY,
+    city TEXT,
+    temperature REAL,
+    humidity INTEGER,
+    aqi INTEGER,
+    rain_probability INTEGER,
+    rain_mm REAL,
+    created_at TIMESTAMPTZ DEFAULT NOW()
+);
+
+-- ✅ Covering index: latest-row-per-city (/api/live) and per-city /data
+-- range + MIN/MAX queries are answered from the index alone.
+-- Supersedes the earlier non-covering ix_weather_logs_city_created.
+CREATE INDEX IF NOT EXISTS ix_wl_city_time
+ON weather_logs (city, created_at DESC)
+INCLUDE (temperature, humidity, aqi, rain_mm, rain_probability);
+
+DROP INDEX IF EXISTS ix_weather_logs_city_created;
+
+-- ✅ At most one row per city per minute (scheduler + /api/live can race).
+-- Existing duplicates are removed once, the first time the index is created.
+DO $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM pg_indexes WHERE indexname = 'ux_weather_logs_city_min') THEN
+        DELETE FROM weather_logs a
+        USING weather_logs b
+        WHERE a.city = b.city
+          AND date_trunc('minute', a.created_at AT TIME ZONE 'UTC')
+            = date_trunc('minute', b.created_at AT TIME ZONE 'UTC')
+          AND a.id > b.id;
+
+        CREATE UNIQUE INDEX ux_weather_logs_city_min
+        ON weather_logs (city, date_trunc('minute', created_at AT TIME ZONE 'UTC'));
+    END IF;
+END $$;
+
+-- ✅ Time-range filters on /data ("ALL" cities)
+CREATE INDEX IF NOT EXISTS ix_weather_logs_created
+ON weather_logs (created_at);
+
+-- ✅ Geocoding results (forward + reverse) to avoid repeat external calls
+CREATE TABLE IF NOT EXISTS geocode_cache (
+    query TEXT PRIMARY KEY,
+    lat REAL,
+    lon REAL,
+    city TEXT,
+    created_at TIMESTAMPTZ DEFAULT NOW()
+);
+
+-- ✅ Keep planner stats current so the indexes above get picked
+ANALYZE weather_logs;
+
+-- ✅ Settings table with freshness
+CREATE TABLE IF NOT EXISTS settings (
+    id INTEGER PRIMARY KEY DEFAULT 1,
+    interval_minutes INTEGER NOT NULL,
+    dashboard_refresh_seconds INTEGER NOT NULL DEFAULT 60,
+    data_freshness_minutes INTEGER NOT NULL DEFAULT 30,
+    updated_at TIMESTAMPTZ DEFAULT NOW()
+);
+
+-- ✅ If DB created earlier without freshness column, add it
+ALTER TABLE settings
+ADD COLUMN IF NOT EXISTS data_freshness_minutes INTEGER NOT NULL DEFAULT 30;
+
+INSERT INTO settings (id, interval_minutes, dashboard_refresh_seconds, data_freshness_minutes, updated_at)
+VALUES (1, 30, 60, 30, NOW())
+ON CONFLICT (id) DO NOTHING;
+
+-- ✅ Tell every process when settings or cities change (see db_change_listener).
+-- Created only when missing, so regular boots don't rewrite the catalog.
+DO $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM pg_proc WHERE proname = 'notify_settings') THEN
+        CREATE FUNCTION notify_settings() RETURNS trigger AS $fn$
+        BEGIN
+            PERFORM pg_notify('settings_changed', '');
+            RETURN NEW;
+        END
+        $fn$ LANGUAGE plpgsql;
+    END IF;
+
+    IF NOT EXISTS (
+        SELECT 1 FROM pg_trigger
+        WHERE tgname = 'settings_changed' AND tgrelid = 'settings'::regclass
+    ) THEN
+        CREATE TRIGGER settings_changed
+        AFTER INSERT OR UPDATE ON settings
+        FOR EACH ROW EXECUTE FUNCTION notify_settings();
+    END IF;
+
+    IF NOT EXISTS (SELECT 1 FROM pg_proc WHERE proname = 'notify_cities') THEN
+        CREATE FUNCTION notify_cities() RETURNS trigger AS $fn$
+        BEGIN
+            PERFORM pg_notify('cities_changed', '');
+            RETURN NULL;
+        END
+        $fn$ LANGUAGE plpgsql;
+    END IF;
+
+    IF NOT EXISTS (
+        SELECT 1 FROM pg_trigger
+        WHERE tgname = 'cities_changed' AND tgrelid = 'cities'::regclass
+    ) THEN
+        CREATE TRIGGER cities_changed
+        AFTER INSERT OR UPDATE OR DELETE ON cities
+        FOR EACH STATEMENT EXECUTE FUNCTION notify_cities();
+    END IF;
+END $$;
+"""
+
+
 def init_db():
     with get_db() as conn, conn.cursor() as cur:
-        cur.execute("""
-        CREATE TABLE IF NOT EXISTS cities (
-            id SERIAL PRIMARY KEY,
-            name TEXT UNIQUE,
-            lat REAL,
-            lon REAL
-        )
-        """)
+        # prepare=False: a multi-statement string can't be a prepared statement
+        cur.execute(INIT_SQL, prepare=False)
 
-        cur.execute("""
-        CREATE TABLE IF NOT EXISTS weather_logs (
-            id SERIAL PRIMARY KEY,
-            city TEXT,
-            temperature REAL,
-            humidity INTEGER,
-            aqi INTEGER,
-            rain_probability INTEGER,
-            rain_mm REAL,
-            created_at TIMESTAMPTZ DEFAULT NOW()
-        )
-        """)
 
-        # ✅ Settings table with freshness
-        cur.execute("""
-        CREATE TABLE IF NOT EXISTS settings (
-            id INTEGER PRIMARY KEY DEFAULT 1,
-            interval_minutes INTEGER NOT NULL,
-            dashboard_refresh_seconds INTEGER NOT NULL DEFAULT 60,
-            data_freshness_minutes INTEGER NOT NULL DEFAULT 30,
-            updated_at TIMESTAMPTZ DEFAULT NOW()
-        );
-        """)
+init_db()
 
-        # ✅ If DB created earlier without freshness column, add it
-        cur.execute("""
-        ALTER TABLE settings
-        ADD COLUMN IF NOT EXISTS data_freshness_minutes INTEGER NOT NULL DEFAULT 30;
-        """)
+# ---------------- HTTP CONFIG ----------------
+# ✅ Keep-alive sessions for the external APIs + a small pool for parallel requests
+SESSION = requests.Session()
+SESSION.mount("https://", HTTPAdapter(pool_connections=32, pool_maxsize=32, max_retries=1))
 
-        cur.execute("""
-        INSERT INTO settings (id, interval_minutes, dashboard_refresh_seconds, data_freshness_minutes, updated_at)
-        VALUES (1, 30, 60, 30, NOW())
-        ON CONFLICT (id) DO NOTHING;
-        """)
+FETCH_EXECUTOR = ThreadPoolExecutor(max_workers=8)
 
 
-init_db()
+class RateLimiter:
+    """Token bucket: allows `limit` calls per `every` seconds, blocking when empty"""
+
+    def __init__(self, limit, every=1.0):
+        self.rate = limit / every
+        self.capacity = limit
+        self.tokens = float(limit)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+            wait = 0.0
+            if self.tokens < 1:
+                wait = (1 - self.tokens) / self.rate
+            self.tokens -= 1
+
+        if wait:
+            time.sleep(wait)
+
+
+# ✅ Nominatim asks for <= 1 req/s; Open-Meteo has per-minute quotas
+RATE_LIMITS = {
+    "nominatim.openstreetmap.org": RateLimiter(limit=1, every=1),
+    "api.open-meteo.com": RateLimiter(limit=10, every=1),
+    "air-quality-api.open-meteo.com": RateLimiter(limit=10, every=1),
+    "geocoding-api.open-meteo.com": RateLimiter(limit=10, every=1),
+}
+
+
+def http_get(url, **kwargs):
+    """SESSION.get, throttled per host"""
+    limiter = RATE_LIMITS.get(urlsplit(url).hostname)
+    if limiter:
+        limiter.acquire()
+    return SESSION.get(url, **kwargs)
+
+
+# ✅ In-flight fetches keyed by (city, minute) so concurrent refreshes share one call
+_inflight = {}
+_inflight_lock = threading.Lock()
 
 # ---------------- UTILITIES ----------------
+# Same escaping as Jinja's tojson, so JSON is safe inside <script>
+_SCRIPT_JSON_ESCAPES = ((b"<", b"\\u003c"), (b">", b"\\u003e"), (b"&", b"\\u0026"), (b"'", b"\\u0027"))
+
+
+def script_json_items(rows):
+    """orjson-serialize rows as comma-separated items (no brackets), HTML-safe"""
+    out = orjson.dumps(rows)[1:-1]
+    for raw, escaped in _SCRIPT_JSON_ESCAPES:
+        out = out.replace(raw, escaped)
+    return out.decode()
+
+
+def stream_page(template_name, **context):
+    """Stream a template, buffering small fragments into larger HTTP chunks"""
+    app.update_template_context(context)
+    stream = app.jinja_env.get_template(template_name).stream(context)
+    stream.enable_buffering(16)
+    return Response(stream_with_context(stream), mimetype="text/html")
+
 def parse_float(val):
     val = (val or "").strip()
     if val == "":
@@ -93,10 +278,46 @@ def valid_lat_lon(lat, lon):
     return (-90.0 <= lat <= 90.0) and (-180.0 <= lon <= 180.0)
 
 # ---------------- GEO HELPERS ----------------
+def geocode_cache_get(query: str):
+    """Returns cached (lat, lon, city) for query if newer than 30 days, else None"""
+    try:
+        with get_db() as conn, conn.cursor() as cur:
+            cur.execute("""
+                SELECT lat, lon, city
+                FROM geocode_cache
+                WHERE query=%s AND created_at > NOW() - INTERVAL '30 days'
+            """, (query,))
+            return cur.fetchone()
+    except Exception as e:
+        print("Geocode cache error:", e)
+        return None
+
+
+def geocode_cache_put(query: str, lat, lon, city):
+    try:
+        with get_db() as conn, conn.cursor() as cur:
+            cur.execute("""
+                INSERT INTO geocode_cache (query, lat, lon, city, created_at)
+                VALUES (%s, %s, %s, %s, NOW())
+                ON CONFLICT (query) DO UPDATE
+                SET lat = EXCLUDED.lat,
+                    lon = EXCLUDED.lon,
+                    city = EXCLUDED.city,
+                    created_at = EXCLUDED.created_at
+            """, (query, lat, lon, city))
+    except Exception as e:
+        print("Geocode cache error:", e)
+
+
 def geocode_city_openmeteo(name: str):
     """City Name -> lat/lon using Open-Meteo geocoding"""
+    query = "name:" + name.strip().lower()
+    cached = geocode_cache_get(query)
+    if cached:
+        return cached[0], cached[1]
+
     try:
-        r = requests.get(
+        r = http_get(
             "https://geocoding-api.open-meteo.com/v1/search",
             params={"name": name, "count": 1},
             timeout=10
@@ -109,6 +330,7 @@ def geocode_city_openmeteo(name: str):
 
         lat = float(data["results"][0]["latitude"])
         lon = float(data["results"][0]["longitude"])
+        geocode_cache_put(query, lat, lon, name)
         return lat, lon
 
     except Exception as e:
@@ -118,12 +340,17 @@ def geocode_city_openmeteo(name: str):
 
 def reverse_geocode_city_nominatim(lat: float, lon: float):
     """lat/lon -> City name using OSM Nominatim reverse geocode"""
+    query = f"latlon:{lat:.4f},{lon:.4f}"
+    cached = geocode_cache_get(query)
+    if cached:
+        return cached[2]
+
     try:
         url = "https://nominatim.openstreetmap.org/reverse"
         params = {"lat": lat, "lon": lon, "format": "json"}
         headers = {"User-Agent": "weather-dashboard/1.0"}
 
-        r = requests.get(url, params=params, headers=headers, timeout=10)
+        r = http_get(url, params=params, headers=headers, timeout=10)
         r.raise_for_status()
         data = r.json()
 
@@ -136,6 +363,8 @@ def reverse_geocode_city_nominatim(lat: float, lon: float):
             addr.get("county")
         )
 
+        if city:
+            geocode_cache_put(query, lat, lon, city)
         return city
 
     except Exception as e:
@@ -144,86 +373,268 @@ def reverse_geocode_city_nominatim(lat: float, lon: float):
 
 
 # ---------------- WEATHER FETCH ----------------
-def fetch_weather(lat, lon):
-    w = requests.get(
+def _get_locations(url, params):
+    data = http_get(url, params=params, timeout=10).json()
+    # Open-Meteo returns an object for one location, a list for several
+    return data if isinstance(data, list) else [data]
+
+
+def fetch_weather_batch(coords):
+    """
+    [(lat, lon), ...] -> {(lat, lon): (temp, humidity, aqi, rain_prob, rain_mm)}
+    using one forecast + one air-quality request for all locations.
+    """
+    if not coords:
+        return {}
+
+    lats = ",".join(str(lat) for lat, _ in coords)
+    lons = ",".join(str(lon) for _, lon in coords)
+
+    forecast = FETCH_EXECUTOR.submit(
+        _get_locations,
         "https://api.open-meteo.com/v1/forecast",
-        params={
-            "latitude": lat,
-            "longitude": lon,
+        {
+            "latitude": lats,
+            "longitude": lons,
             "current_weather": True,
             "hourly": "relativehumidity_2m,precipitation_probability,precipitation"
-        },
-        timeout=10
-    ).json()
+        }
+    )
+    air = FETCH_EXECUTOR.submit(
+        _get_locations,
+        "https://air-quality-api.open-meteo.com/v1/air-quality",
+        {"latitude": lats, "longitude": lons, "current": "us_aqi"}
+    )
 
-    temp = w["current_weather"]["temperature"]
-    humidity = w["hourly"]["relativehumidity_2m"][0]
-    rain_prob = w["hourly"]["precipitation_probability"][0]
-    rain_mm = w["hourly"]["precipitation"][0]
+    results = {}
+    for coord, w, q in zip(coords, forecast.result(), air.result()):
+        temp = w["current_weather"]["temperature"]
+        humidity = w["hourly"]["relativehumidity_2m"][0]
+        rain_prob = w["hourly"]["precipitation_probability"][0]
+        rain_mm = w["hourly"]["precipitation"][0]
+        aqi = q["current"]["us_aqi"]
+        results[coord] = (temp, humidity, aqi, rain_prob, rain_mm)
 
-    aqi = requests.get(
-        "https://air-quality-api.open-meteo.com/v1/air-quality",
-        params={"latitude": lat, "longitude": lon, "current": "us_aqi"},
-        timeout=10
-    ).json()["current"]["us_aqi"]
+    return results
 
-    return temp, humidity, aqi, rain_prob, rain_mm
+
+def fetch_weather_many(cities):
+    """
+    Fetch weather for [(name, lat, lon), ...] in one batch.
+    Cities already being fetched by another caller this minute wait on that
+    request instead of hitting the API again.
+    Returns ({name: (temp, humidity, aqi, rain_prob, rain_mm)}, {names fetched by this call});
+    failed cities are skipped.
+    """
+    minute = int(time.time() // 60)
+    futures = {}
+    mine = []
+
+    with _inflight_lock:
+        for name, lat, lon in cities:
+            key = (name, minute)
+            future = _inflight.get(key)
+            if future is None:
+                future = Future()
+                _inflight[key] = future
+                mine.append((name, lat, lon))
+            futures[name] = future
+
+    if mine:
+        try:
+            batch = fetch_weather_batch([(lat, lon) for _, lat, lon in mine])
+            for name, lat, lon in mine:
+                if (lat, lon) in batch:
+                    futures[name].set_result(batch[(lat, lon)])
+                else:
+                    futures[name].set_exception(LookupError("missing from batch response"))
+        except Exception as e:
+            for name, _, _ in mine:
+                if not futures[name].done():
+                    futures[name].set_exception(e)
+        finally:
+            with _inflight_lock:
+                for name, _, _ in mine:
+                    _inflight.pop((name, minute), None)
+
+    results = {}
+    owned = {name for name, _, _ in mine}
+    for name, future in futures.items():
+        try:
+            results[name] = future.result()
+        except Exception as e:
+            print("Fetch error:", name, e)
+            owned.discard(name)
+    return results, owned
 
 
 # ---------------- DB CACHE HELPERS ----------------
-def get_cached_weather(city_name: str):
+INSERT_WEATHER_LOG = """
+    INSERT INTO weather_logs
+    (city, temperature, humidity, aqi, rain_probability, rain_mm)
+    VALUES (%s,%s,%s,%s,%s,%s)
+    ON CONFLICT DO NOTHING
+"""
+
+
+def save_weather_logs(rows):
     """
-    Returns latest cached row:
-    (temperature, humidity, aqi, rain_probability, rain_mm, created_at)
+    Batch insert [(city, temperature, humidity, aqi, rain_probability, rain_mm), ...]
+    in one round-trip.
     """
+    if not rows:
+        return
+
     with get_db() as conn, conn.cursor() as cur:
-        cur.execute("""
-            SELECT temperature, humidity, aqi, rain_probability, rain_mm, created_at
-            FROM weather_logs
-            WHERE city=%s
-            ORDER BY created_at DESC
-            LIMIT 1
-        """, (city_name,))
-        return cur.fetchone()
+        cur.executemany(INSERT_WEATHER_LOG, rows)
 
 
-def save_weather_log(city_name: str, t, h, aqi, rp, rm):
-    with get_db() as conn, conn.cursor() as cur:
-        cur.execute("""
-            INSERT INTO weather_logs
-            (city, temperature, humidity, aqi, rain_probability, rain_mm)
-            VALUES (%s,%s,%s,%s,%s,%s)
-        """, (city_name, t, h, aqi, rp, rm))
+# ---------------- SETTINGS CACHE ----------------
+# ✅ Settings only change via the Settings form; updates are pushed to every
+# process via LISTEN/NOTIFY, the TTL is only a safety net if the listener drops
+SETTINGS_TTL_SECONDS = 300
+# "version" is bumped on every invalidation; a cached value is only valid if it
+# was loaded under the current version (a NOTIFY racing a reload wins)
+_settings_cache = {"v": None, "t": 0.0, "loaded_version": -1, "version": 0}
+_settings_lock = threading.Lock()
+_settings_version_lock = threading.Lock()
+
+
+def invalidate_settings_cache():
+    with _settings_version_lock:
+        _settings_cache["version"] += 1
+
+
+def get_settings():
+    with _settings_lock:
+        if (
+            _settings_cache["v"] is not None
+            and _settings_cache["loaded_version"] == _settings_cache["version"]
+            and time.monotonic() - _settings_cache["t"] < SETTINGS_TTL_SECONDS
+        ):
+            return _settings_cache["v"]
+
+        version = _settings_cache["version"]
+        with get_db() as conn, conn.cursor() as cur:
+            cur.execute("""
+                SELECT interval_minutes,
+                       dashboard_refresh_seconds,
+                       data_freshness_minutes
+                FROM settings
+                WHERE id=1
+            """)
+            interval, dash_refresh, freshness = cur.fetchone()
+
+        _settings_cache["v"] = {
+            "interval_minutes": interval,
+            "dashboard_refresh_seconds": dash_refresh,
+            "data_freshness_minutes": freshness
+        }
+        _settings_cache["t"] = time.monotonic()
+        # If invalidated mid-reload this stays behind "version", so the next call reloads
+        _settings_cache["loaded_version"] = version
+        return _settings_cache["v"]
+
+
+# ---------------- LIVE SNAPSHOT ----------------
+# ✅ Latest tiles collected by the scheduler, pushed to /stream subscribers and
+# served directly by /api/live while "valid" and fresh. "generation" is bumped
+# whenever cities/settings change so a collection started before that is discarded.
+_live_snapshot = {"payload": None, "version": 0, "ts": 0.0, "valid": False, "generation": 0}
+_live_snapshot_cond = threading.Condition()
+
+
+def weather_tile(name, t, h, a, rp, rm, source, created_at):
+    return {
+        "city": name,
+        "temp": t,
+        "humidity": h,
+        "aqi": a,
+        "rain": rp,
+        "mm": rm,
+        "source": source,
+        "time": created_at.isoformat()
+    }
+
+
+def publish_live_snapshot(payload, generation):
+    """
+    payload must cover every tracked city: /stream clients replace all tiles with it.
+    Dropped if the snapshot was invalidated since `generation` was read.
+    """
+    with _live_snapshot_cond:
+        if generation != _live_snapshot["generation"]:
+            return
+        _live_snapshot["payload"] = payload
+        _live_snapshot["version"] += 1
+        _live_snapshot["ts"] = time.monotonic()
+        _live_snapshot["valid"] = True
+        _live_snapshot_cond.notify_all()
+
+
+def invalidate_live_snapshot():
+    with _live_snapshot_cond:
+        _live_snapshot["generation"] += 1
+        _live_snapshot["valid"] = False
+
+
+def get_fresh_live_snapshot(freshness_minutes):
+    """Scheduler payload if still valid and within the freshness window, else None"""
+    with _live_snapshot_cond:
+        if _live_snapshot["valid"] and time.monotonic() - _live_snapshot["ts"] < freshness_minutes * 60:
+            return _live_snapshot["payload"]
+    return None
 
 
 # ---------------- SCHEDULER ----------------
-scheduler = BackgroundScheduler()
+# ✅ With several server processes, only one should run the scheduler (RUN_SCHEDULER=0 on the rest)
+SCHEDULER_ENABLED = os.getenv("RUN_SCHEDULER", "1") == "1"
+
+# ✅ coalesce + max_instances=1: a slow run never piles up behind itself
+scheduler = BackgroundScheduler(
+    executors={"default": SchedulerThreadPool(max_workers=4)},
+    job_defaults={"coalesce": True, "max_instances": 1, "misfire_grace_time": 30}
+)
 
 
 def get_interval():
-    with get_db() as conn, conn.cursor() as cur:
-        cur.execute("SELECT interval_minutes FROM settings WHERE id=1")
-        return cur.fetchone()[0]
+    return get_settings()["interval_minutes"]
 
 
 def collect_weather():
+    generation = _live_snapshot["generation"]
+
     with get_db() as conn, conn.cursor() as cur:
         cur.execute("SELECT name, lat, lon FROM cities")
-        for name, lat, lon in cur.fetchall():
-            try:
-                if lat is None or lon is None:
-                    continue
-                t, h, a, rp, rm = fetch_weather(lat, lon)
-                cur.execute("""
-                    INSERT INTO weather_logs
-                    (city, temperature, humidity, aqi, rain_probability, rain_mm)
-                    VALUES (%s,%s,%s,%s,%s,%s)
-                """, (name, t, h, a, rp, rm))
-            except Exception as e:
-                print("Scheduler error:", e)
+        cities = [
+            (name, lat, lon)
+            for name, lat, lon in cur.fetchall()
+            if lat is not None and lon is not None
+        ]
+
+    # ✅ No pool connection held during the (possibly slow) outbound fetch
+    fetched, owned = fetch_weather_many(cities)
+    rows = [(name, *fetched[name]) for name in owned]
+
+    try:
+        save_weather_logs(rows)
+    except Exception as e:
+        print("Scheduler error:", e)
+
+    # Only push complete snapshots: a partial one would drop the failed
+    # cities' tiles from every open dashboard (polling fills them in instead)
+    if len(fetched) == len(cities):
+        now_utc = datetime.now(timezone.utc)
+        publish_live_snapshot(
+            [weather_tile(name, *fetched[name], "api", now_utc) for name, _, _ in cities],
+            generation
+        )
 
 
 def schedule_job():
+    if not SCHEDULER_ENABLED:
+        return
+
     interval = get_interval()
     job = scheduler.get_job("weather_job")
 
@@ -239,29 +650,40 @@ def schedule_job():
 
 
 schedule_job()
-scheduler.start()
 
+if SCHEDULER_ENABLED:
+    scheduler.start()
 
-def get_settings():
-    with get_db() as conn, conn.cursor() as cur:
-        cur.execute("""
-            SELECT interval_minutes,
-                   dashboard_refresh_seconds,
-                   data_freshness_minutes
-            FROM settings
-            WHERE id=1
-        """)
-        interval, dash_refresh, freshness = cur.fetchone()
 
-    return {
-        "interval_minutes": interval,
-        "dashboard_refresh_seconds": dash_refresh,
-        "data_freshness_minutes": freshness
-    }
+def db_change_listener():
+    """Drop cached settings / live snapshot whenever any process changes settings or cities"""
+    while True:
+        try:
+            with psycopg.connect(DB_CONNINFO, autocommit=True) as conn:
+                conn.execute("LISTEN settings_changed")
+                conn.execute("LISTEN cities_changed")
+                # Anything may have changed while we weren't listening
+                invalidate_settings_cache()
+                invalidate_live_snapshot()
+                for notify in conn.notifies():
+                    invalidate_live_snapshot()
+                    if notify.channel == "settings_changed":
+                        invalidate_settings_cache()
+                        if scheduler.running:
+                            schedule_job()
+        except Exception as e:
+            print("DB change listener error:", e)
+            time.sleep(5)
+
+
+threading.Thread(target=db_change_listener, name="db-change-listener", daemon=True).start()
 
 
 # ✅ UPDATED to include paused
 def get_scheduler_status():
+    if not SCHEDULER_ENABLED:
+        return {"status": "Disabled", "next_run": None, "paused": True}
+
     try:
         job = scheduler.get_job("weather_job")
 
@@ -319,7 +741,8 @@ def dashboard():
     return render_template(
         "dashboard.html",
         title="Dashboard",
-        refresh_seconds=settings["dashboard_refresh_seconds"]
+        refresh_seconds=settings["dashboard_refresh_seconds"],
+        interval_minutes=settings["interval_minutes"]
     )
 
 
@@ -328,58 +751,114 @@ def live_api():
     settings = get_settings()
     freshness_minutes = int(settings.get("data_freshness_minutes", 30))
 
+    # ✅ Scheduler snapshot still fresh => no DB work at all
+    payload = get_fresh_live_snapshot(freshness_minutes)
+    if payload is not None:
+        return Response(orjson.dumps(payload), mimetype="application/json")
+
+    # ✅ Cities + latest *fresh* cached row per city in one round-trip
+    # (no row joined => cache miss, fetch from API)
     with get_db() as conn, conn.cursor() as cur:
-        cur.execute("SELECT name, lat, lon FROM cities")
+        cur.execute("""
+            SELECT c.name, c.lat, c.lon,
+                   w.temperature, w.humidity, w.aqi,
+                   w.rain_probability, w.rain_mm, w.created_at
+            FROM cities c
+            LEFT JOIN LATERAL (
+                SELECT temperature, humidity, aqi, rain_probability, rain_mm, created_at
+                FROM weather_logs
+                WHERE city = c.name
+                  AND created_at >= NOW() - make_interval(mins => %s)
+                ORDER BY created_at DESC
+                LIMIT 1
+            ) w ON true
+        """, (freshness_minutes,))
         cities = cur.fetchall()
 
-    data = []
+    order = []
+    tiles = {}
+    stale = []
+
+    for name, lat, lon, *cached in cities:
+        if lat is None or lon is None:
+            continue
+        order.append(name)
+
+        # ✅ Use DB cache if fresh
+        if cached[-1] is not None:
+            *weather, created_at = cached
+            tiles[name] = weather_tile(name, *weather, "db", created_at)
+            continue
+
+        stale.append((name, lat, lon))
+
+    # ✅ Otherwise fetch from API (all stale cities in one batch)
+    fetched, owned = fetch_weather_many(stale)
     now_utc = datetime.now(timezone.utc)
+    for name, weather in fetched.items():
+        tiles[name] = weather_tile(name, *weather, "api", now_utc)
 
-    for name, lat, lon in cities:
-        try:
-            if lat is None or lon is None:
-                continue
-
-            cached = get_cached_weather(name)
-
-            # ✅ Use DB cache if fresh
-            if cached:
-                t, h, a, rp, rm, created_at = cached
-                age_minutes = (now_utc - created_at).total_seconds() / 60.0
-
-                if age_minutes <= freshness_minutes:
-                    data.append({
-                        "city": name,
-                        "temp": t,
-                        "humidity": h,
-                        "aqi": a,
-                        "rain": rp,
-                        "mm": rm,
-                        "source": "db",
-                        "time": created_at.isoformat()
-                    })
-                    continue
-
-            # ✅ Otherwise fetch from API
-            t, h, a, rp, rm = fetch_weather(lat, lon)
-
-            data.append({
-                "city": name,
-                "temp": t,
-                "humidity": h,
-                "aqi": a,
-                "rain": rp,
-                "mm": rm,
-                "source": "api"
-            })
-
-            # ✅ Save fetched data into DB so next call uses cache
-            save_weather_log(name, t, h, a, rp, rm)
+    # ✅ Save fetched data into DB (one batch) so next call uses cache;
+    # rows shared from another caller's fetch are saved by that caller
+    try:
+        save_weather_logs([(name, *fetched[name]) for name in owned])
+    except Exception as e:
+        print("Live API error:", e)
+
+    data = [tiles[name] for name in order if name in tiles]
+    return Response(orjson.dumps(data), mimetype="application/json")
 
-        except Exception as e:
-            print("Live API error:", e)
 
-    return jsonify(data)
+_stream_slots = threading.BoundedSemaphore(MAX_STREAMS)
+
+
+@app.route("/stream")
+def stream():
+    """Server-Sent Events: push each new scheduler snapshot to the dashboard"""
+    # Snapshots are only produced where the scheduler runs; elsewhere clients just poll
+    if not SCHEDULER_ENABLED:
+        return Response("Live stream not available on this process", status=503)
+
+    freshness_minutes = int(get_settings().get("data_freshness_minutes", 30))
+    initial = get_fresh_live_snapshot(freshness_minutes)
+
+    # ✅ Over the cap, clients keep polling /api/live instead
+    if not _stream_slots.acquire(blocking=False):
+        return Response("Too many live streams", status=503)
+
+    def events():
+        with _live_snapshot_cond:
+            seen = _live_snapshot["version"]
+
+        # Current snapshot first, so the client can stop polling right away
+        if initial is not None:
+            yield f"data: {orjson.dumps(initial).decode()}\n\n"
+
+        while True:
+            with _live_snapshot_cond:
+                # Short keep-alive period: writes to a closed tab fail (and free
+                # its slot) within ~10 s
+                _live_snapshot_cond.wait_for(lambda: _live_snapshot["version"] != seen, timeout=10)
+                if _live_snapshot["version"] == seen:
+                    payload = None
+                else:
+                    seen = _live_snapshot["version"]
+                    payload = _live_snapshot["payload"]
+
+            if payload is None:
+                # keep-alive so proxies don't drop idle connections
+                yield ": keep-alive\n\n"
+            else:
+                yield f"data: {orjson.dumps(payload).decode()}\n\n"
+
+    response = Response(
+        events(),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+    # Runs when the server closes the response (client gone), even if never iterated
+    response.call_on_close(_stream_slots.release)
+    return response
 
 
 @app.route("/data")
@@ -403,14 +882,16 @@ def data():
         params.extend([start, end])
     else:
         hours = int(hours or 24)
-        where.append(f"created_at >= NOW() - INTERVAL '{hours} hours'")
+        where.append("created_at >= NOW() - %s::interval")
+        params.append(f"{hours} hours")
 
     where_sql = " AND ".join(where)
     if where_sql:
         where_sql = "WHERE " + where_sql
 
     query = f"""
-        SELECT city, temperature, humidity, aqi, rain_mm, rain_probability, created_at
+        SELECT city, temperature, humidity, aqi, rain_mm, rain_probability,
+               to_char(created_at, 'YYYY-MM-DD HH24:MI')
         FROM weather_logs
         {where_sql}
         ORDER BY created_at
@@ -432,28 +913,28 @@ def data():
         ORDER BY city
     """
 
-    with get_db() as conn, conn.cursor() as cur:
-        cur.execute(query, params)
-        rows = cur.fetchall()
-
-        cur.execute(summary_query, params)
-        summary_rows = cur.fetchall()
-
-        cur.execute("SELECT name FROM cities ORDER BY name")
-        city_list = [c[0] for c in cur.fetchall()]
-
-    rows_js = [
-        {
-            "city": r[0],
-            "temperature": r[1],
-            "humidity": r[2],
-            "aqi": r[3],
-            "rain_mm": r[4],
-            "rain_probability": r[5],
-            "time": r[6].strftime("%Y-%m-%d %H:%M")
-        }
-        for r in rows
-    ]
+    # ✅ Pipeline the small queries so they share a single round-trip
+    with get_db() as conn, conn.pipeline(), \
+            conn.cursor() as summary_cur, conn.cursor() as city_cur:
+        summary_cur.execute(summary_query, params)
+        city_cur.execute("SELECT name FROM cities ORDER BY name")
+
+        summary_rows = summary_cur.fetchall()
+        city_list = [c[0] for c in city_cur.fetchall()]
+
+    # ✅ Detail rows come from a server-side cursor while the page streams,
+    # so long ranges are never materialized in full
+    # Yields one pre-serialized JSON piece per 2000-row batch.
+    # A stalled client can't pin the pool slot/transaction for long: Postgres
+    # ends the session once it idles between chunks for too long.
+    def iter_rows_json():
+        with get_db() as conn, conn.transaction():
+            conn.execute("SET LOCAL statement_timeout = '30s'")
+            conn.execute("SET LOCAL idle_in_transaction_session_timeout = '60s'")
+            with conn.cursor(name="data_cur") as cur:
+                cur.execute(query, params)
+                while batch := cur.fetchmany(2000):
+                    yield script_json_items(batch)
 
     # ✅ Summary output JS
     summary_js = [
@@ -461,10 +942,10 @@ def data():
         for s in summary_rows
     ]
 
-    return render_template(
+    return stream_page(
         "data.html",
         title="Data",
-        rows=rows_js,
+        rows_json=iter_rows_json(),
         metric=metric,
         city=city,
         city_list=city_list,
@@ -492,6 +973,8 @@ def settings():
             """, (interval, dash_refresh, freshness))
 
             conn.commit()
+            invalidate_settings_cache()
+            invalidate_live_snapshot()
             schedule_job()
             return redirect(url_for("settings", saved=1))
 
@@ -609,6 +1092,7 @@ def cities():
                 """, (final_city, final_lat, final_lon))
 
                 conn.commit()
+                invalidate_live_snapshot()
 
                 if exists:
                     return redirect(url_for("cities", msg=f"ℹ️ City '{final_city}' already exists. Updated lat/lon.", type="warning"))
@@ -620,6 +1104,7 @@ def cities():
                 city_id = request.form.get("city_id")
                 cur.execute("DELETE FROM cities WHERE id=%s", (city_id,))
                 conn.commit()
+                invalidate_live_snapshot()
                 return redirect(url_for("cities", msg="🗑 City deleted successfully!", type="warning"))
 
         # ✅ GET city list
@@ -638,4 +1123,10 @@ def cities():
 
 
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=8000)
+    # ✅ Prefer a multi-threaded production server; fall back to the Flask dev server
+    try:
+        from waitress import serve
+    except ImportError:
+        app.run(host="0.0.0.0", port=8000)
+    else:
+        serve(app, host="0.0.0.0", port=8000, threads=WEB_THREADS)
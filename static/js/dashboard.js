@@ -12,57 +12,61 @@ function rainBadge(rainProb) {
     return `<span class="badge bg-secondary">Low Rain</span>`;
 }
 
-async function loadTiles() {
-    document.getElementById("loading").style.display = "block";
-
+function renderTiles(data) {
     const tiles = document.getElementById("tiles");
-    tiles.style.display = "none";
     tiles.innerHTML = "";
 
-    try {
-        const res = await fetch("/api/live");
-        const data = await res.json();
-
-        if (!data || data.length === 0) {
-            tiles.innerHTML = `
-                <div class="col-12">
-                    <div class="alert alert-warning shadow-sm">
-                        ⚠️ No cities found. Please add cities from <b>Cities</b> menu.
-                    </div>
-                </div>`;
-        } else {
-            data.forEach(d => {
-                tiles.innerHTML += `
-                <div class="col-xl-3 col-lg-4 col-md-6">
-                    <div class="card h-100">
-                        <div class="card-body">
-
-                            <div class="d-flex justify-content-between align-items-start">
-                                <h5 class="card-title mb-2">📍 ${d.city}</h5>
-                                <span class="${aqiClass(d.aqi)}">AQI ${d.aqi}</span>
-                            </div>
-
-                            <div class="metric-line">🌡 <b>${d.temp}</b> °C</div>
-                            <div class="metric-line">💧 <b>${d.humidity}</b>% Humidity</div>
-                            <div class="metric-line">
-                                🌧 <b>${d.rain}</b>% | 💧 <b>${d.mm}</b> mm
-                                <span class="ms-auto">${rainBadge(d.rain)}</span>
-                            </div>
+    if (!data || data.length === 0) {
+        tiles.innerHTML = `
+            <div class="col-12">
+                <div class="alert alert-warning shadow-sm">
+                    ⚠️ No cities found. Please add cities from <b>Cities</b> menu.
+                </div>
+            </div>`;
+    } else {
+        data.forEach(d => {
+            tiles.innerHTML += `
+            <div class="col-xl-3 col-lg-4 col-md-6">
+                <div class="card h-100">
+                    <div class="card-body">
 
+                        <div class="d-flex justify-content-between align-items-start">
+                            <h5 class="card-title mb-2">📍 ${d.city}</h5>
+                            <span class="${aqiClass(d.aqi)}">AQI ${d.aqi}</span>
                         </div>
 
-                        <div class="card-footer small text-muted d-flex justify-content-between align-items-center">
-                            <span><span class="emoji-pulse">🟢</span> Live</span>
-                            <span class="text-muted">Auto refresh</span>
+                        <div class="metric-line">🌡 <b>${d.temp}</b> °C</div>
+                        <div class="metric-line">💧 <b>${d.humidity}</b>% Humidity</div>
+                        <div class="metric-line">
+                            🌧 <b>${d.rain}</b>% | 💧 <b>${d.mm}</b> mm
+                            <span class="ms-auto">${rainBadge(d.rain)}</span>
                         </div>
+
                     </div>
-                </div>`;
-            });
-        }
 
-        document.getElementById("lastUpdated").innerText =
-            "Last updated: " + new Date().toLocaleString();
+                    <div class="card-footer small text-muted d-flex justify-content-between align-items-center">
+                        <span><span class="emoji-pulse">🟢</span> Live</span>
+                        <span class="text-muted">Auto refresh</span>
+                    </div>
+                </div>
+            </div>`;
+        });
+    }
 
+    document.getElementById("lastUpdated").innerText =
+        "Last updated: " + new Date().toLocaleString();
+}
+
+async function loadTiles() {
+    document.getElementById("loading").style.display = "block";
+
+    const tiles = document.getElementById("tiles");
+    tiles.style.display = "none";
+    tiles.innerHTML = "";
+
+    try {
+        const res = await fetch("/api/live");
+        renderTiles(await res.json());
     } catch (err) {
         tiles.innerHTML = `
             <div class="col-12">
@@ -79,5 +83,38 @@ async function loadTiles() {
 
 loadTiles();
 
+// ✅ Scheduler snapshots are pushed over SSE (once per scheduler interval);
+// polling only runs while no healthy stream is delivering them
+let stream = null;
+let lastPush = 0;
+
+function openStream() {
+    if (!window.EventSource) return;
+
+    stream = new EventSource("/stream");
+    stream.onmessage = (e) => {
+        lastPush = Date.now();
+        renderTiles(JSON.parse(e.data));
+    };
+    stream.onerror = () => {
+        // CLOSED = server refused (e.g. 503 over the stream cap); retried on the next tick
+        if (stream.readyState === EventSource.CLOSED) stream = null;
+    };
+}
+
+function streamIsLive() {
+    // A push is due every scheduler interval; allow one refresh period of slack
+    const maxAge = INTERVAL_MINUTES * 60 * 1000 + REFRESH_SECONDS * 1000;
+    return stream !== null &&
+        stream.readyState === EventSource.OPEN &&
+        Date.now() - lastPush < maxAge;
+}
+
+openStream();
+
 // background refresh (customizable)
-setInterval(loadTiles, REFRESH_SECONDS * 1000);
+setInterval(() => {
+    if (streamIsLive()) return;
+    loadTiles();
+    if (stream === null) openStream();
+}, REFRESH_SECONDS * 1000);
@@ -42,17 +42,23 @@ function labelForMetric(m) {
 
 const metric = DEFAULT_METRIC;
 
+// ROWS are raw [city, temperature, humidity, aqi, rain_mm, rain_probability, time] arrays
+const COLUMNS = ["city", "temperature", "humidity", "aqi", "rain_mm", "rain_probability", "time"];
+const CITY = 0;
+const TIME = 6;
+const METRIC = COLUMNS.indexOf(metric);
+
 // Group rows by city
 const grouped = {};
 ROWS.forEach(r => {
-    if (!grouped[r.city]) grouped[r.city] = [];
-    grouped[r.city].push(r);
+    if (!grouped[r[CITY]]) grouped[r[CITY]] = [];
+    grouped[r[CITY]].push(r);
 });
 
 // Build datasets (one line per city)
 const datasets = Object.keys(grouped).map(city => ({
     label: city,
-    data: grouped[city].map(r => r[metric]),
+    data: grouped[city].map(r => r[METRIC]),
     borderColor: cityColor(city),
     backgroundColor: cityColor(city),
     tension: 0.35,
@@ -64,7 +70,7 @@ const datasets = Object.keys(grouped).map(city => ({
 let labels = [];
 if (Object.keys(grouped).length > 0) {
     const firstCity = Object.keys(grouped)[0];
-    labels = grouped[firstCity].map(r => r.time);
+    labels = grouped[firstCity].map(r => r[TIME]);
 }
 
 new Chart(document.getElementById("chart"), {